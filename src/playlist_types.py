@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import dataclasses
-from typing import AbstractSet, Generic, NewType, TypeVar
+from typing import FrozenSet, Generic, NewType, TypeVar
 
 TPlaylistID = TypeVar("TPlaylistID", bound=str)
 ScrapedPlaylistID = NewType("ScrapedPlaylistID", str)
@@ -13,7 +13,7 @@ class Playlist(Generic[TPlaylistID]):
     playlist_id: TPlaylistID
     name: str
     description: str
-    track_ids: AbstractSet[str]
+    track_ids: FrozenSet[str]
 
 
 class ScrapedPlaylist(Playlist[ScrapedPlaylistID]):
@@ -6,12 +6,29 @@ import argparse
 import asyncio
 import collections
 import dataclasses
-import json
+import functools
 import logging
-import os
 import pathlib
+import pickle
+import sys
+import threading
 import urllib.parse
-from typing import Dict, List, Mapping, Sequence, Set, Tuple
+import webbrowser
+from typing import (
+    Any,
+    Coroutine,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import orjson
+import simdjson
 
 from plants.committer import Committer
 from plants.environment import Environment
@@ -28,6 +45,17 @@ from spotify import Spotify
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+class _ThreadLocal(threading.local):
+    # simdjson parsers reuse their internal buffers across documents, but
+    # they aren't thread-safe, so keep one per worker thread
+    simdjson_parser: Optional[simdjson.Parser] = None
+
+
+_thread_local = _ThreadLocal()
+
 
 @dataclasses.dataclass(frozen=True)
 class PlaylistMapping:
@@ -41,7 +69,7 @@ class Playlists:
 
     @classmethod
     def from_json(cls, content: str) -> Playlists:
-        playlists = json.loads(content)
+        playlists = orjson.loads(content)
         assert isinstance(playlists, dict)
 
         mappings: List[PlaylistMapping] = []
@@ -81,55 +109,172 @@ class Playlists:
             raise Exception(f"Some published IDs appear more than once: {overlaps}")
 
     def to_json(self) -> str:
-        return json.dumps(
-            dataclasses.asdict(self),
-            indent=2,
-            sort_keys=True,
+        return self.to_json_bytes().decode()
+
+    def to_json_bytes(self) -> bytes:
+        # Build the dicts directly, dataclasses.asdict deep-copies every field
+        content = {
+            "mappings": [
+                {
+                    "scraped_playlist_id": mapping.scraped_playlist_id,
+                    "published_playlist_ids": mapping.published_playlist_ids,
+                }
+                for mapping in self.mappings
+            ]
+        }
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS,
         )
 
 
-def get_scraped_playlists(
+# Maps the path of a scraped playlist file to its mtime, size, and contents
+ScrapedPlaylistsCache = Dict[str, Tuple[int, int, ScrapedPlaylist]]
+
+# Bump whenever _read_scraped_playlist changes what it returns, so that
+# entries written by older code are discarded
+_SCRAPED_PLAYLISTS_CACHE_VERSION = 1
+
+
+async def get_scraped_playlists(
     playlists_dir: pathlib.Path,
+    cache_path: Optional[pathlib.Path] = None,
 ) -> Dict[ScrapedPlaylistID, ScrapedPlaylist]:
     logger.info(f"Reading playlists from {playlists_dir}")
 
-    json_files: List[pathlib.Path] = []
-    for path in (playlists_dir / "cumulative").iterdir():
-        if str(path).endswith(".json"):
-            json_files.append(path)
-
-    scraped_playlists: Dict[ScrapedPlaylistID, ScrapedPlaylist] = {}
-    for path in json_files:
-        with open(path, "r") as f:
-            playlist = json.load(f)
-        track_ids: Set[str] = set()
-        for track in playlist["tracks"]:
-            track_id = track["url"].split("/")[-1]
-            track_ids.add(track_id)
-        playlist_id = ScrapedPlaylistID(path.name[: -len(".json")])
-        description = f"Link to archive: https://tinyurl.com/4mvw765u/{playlist_id}.md"
-        scraped_playlists[playlist_id] = ScrapedPlaylist(
-            playlist_id=playlist_id,
-            name=playlist["name"] + " (Cumulative)",
-            description=description,
-            track_ids=track_ids,
+    json_files = list((playlists_dir / "cumulative").glob("*.json"))
+
+    # Skip parsing files that haven't changed since the last run
+    cache: ScrapedPlaylistsCache = {}
+    if cache_path:
+        cache = await asyncio.to_thread(_read_scraped_playlists_cache, cache_path)
+
+    # Read the files concurrently, but bound the number of open files
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(32)
+
+    async def read_scraped_playlist(
+        path: pathlib.Path,
+    ) -> Tuple[int, int, ScrapedPlaylist]:
+        async with semaphore:
+            return await asyncio.to_thread(
+                _read_scraped_playlist_if_changed, path, cache
+            )
+
+    results = await asyncio.gather(
+        *(read_scraped_playlist(path) for path in json_files)
+    )
+    if cache_path:
+        next_cache = {str(path): entry for path, entry in zip(json_files, results)}
+        # Only rewrite the cache if entries were added, refreshed, or removed
+        if len(next_cache) != len(cache) or any(
+            entry is not cache.get(path) for path, entry in next_cache.items()
+        ):
+            await asyncio.to_thread(
+                _write_scraped_playlists_cache, cache_path, next_cache
+            )
+    return {playlist.playlist_id: playlist for _, _, playlist in results}
+
+
+def _read_scraped_playlists_cache(cache_path: pathlib.Path) -> ScrapedPlaylistsCache:
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable playlists cache: {e}")
+        return {}
+    if (
+        not isinstance(cache, dict)
+        or cache.get("version") != _SCRAPED_PLAYLISTS_CACHE_VERSION
+    ):
+        logger.info(f"Ignoring outdated playlists cache: {cache_path}")
+        return {}
+    return cache["entries"]
+
+
+def _write_scraped_playlists_cache(
+    cache_path: pathlib.Path, entries: ScrapedPlaylistsCache
+) -> None:
+    with open(cache_path, "wb") as f:
+        pickle.dump(
+            {"version": _SCRAPED_PLAYLISTS_CACHE_VERSION, "entries": entries}, f
         )
 
-    return scraped_playlists
 
+def _read_scraped_playlist_if_changed(
+    path: pathlib.Path, cache: ScrapedPlaylistsCache
+) -> Tuple[int, int, ScrapedPlaylist]:
+    stat = path.stat()
+    cached = cache.get(str(path))
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached
+    return (stat.st_mtime_ns, stat.st_size, _read_scraped_playlist(path))
+
+
+def _get_simdjson_parser() -> simdjson.Parser:
+    parser = _thread_local.simdjson_parser
+    if parser is None:
+        parser = simdjson.Parser()
+        _thread_local.simdjson_parser = parser
+    return parser
+
+
+def _read_scraped_playlist(path: pathlib.Path) -> ScrapedPlaylist:
+    # Only materialize the fields we need, not the whole document. The
+    # document must not outlive this function, otherwise the parser can't
+    # be reused for the next file.
+    playlist = _get_simdjson_parser().parse(path.read_bytes())
+    assert isinstance(playlist, simdjson.Object)
+    name = playlist["name"]
+    assert isinstance(name, str)
+    tracks = playlist["tracks"]
+    assert isinstance(tracks, simdjson.Array)
+    track_ids = frozenset(_get_track_id(track) for track in tracks)
+    playlist_id = ScrapedPlaylistID(path.name[: -len(".json")])
+    description = f"Link to archive: https://tinyurl.com/4mvw765u/{playlist_id}.md"
+    return ScrapedPlaylist(
+        playlist_id=playlist_id,
+        name=name + " (Cumulative)",
+        description=description,
+        track_ids=track_ids,
+    )
+
+
+def _get_track_id(track: object) -> str:
+    assert isinstance(track, simdjson.Object)
+    url = track["url"]
+    assert isinstance(url, str)
+    # Intern track IDs so that playlists sharing a track share one string
+    return sys.intern(url.rpartition("/")[2])
+
+
+@dataclasses.dataclass(frozen=True)
+class ClientCredentials:
+    client_id: str
+    client_secret: str
 
-async def publish(playlists_dir: pathlib.Path, prod: bool) -> None:
 
+@functools.lru_cache(maxsize=1)
+def get_client_credentials() -> ClientCredentials:
     # Check nonempty to fail fast
     client_id = Environment.get_env("SPOTIFY_CLIENT_ID")
     client_secret = Environment.get_env("SPOTIFY_CLIENT_SECRET")
+    assert client_id and client_secret
+    return ClientCredentials(client_id=client_id, client_secret=client_secret)
+
+
+async def publish(playlists_dir: pathlib.Path, prod: bool) -> None:
+
+    credentials = get_client_credentials()
+    # Check nonempty to fail fast
     refresh_token = Environment.get_env("SPOTIFY_REFRESH_TOKEN")
-    assert client_id and client_secret and refresh_token
+    assert refresh_token
 
     # Initialize Spotify client
     spotify = Spotify(
-        client_id=client_id,
-        client_secret=client_secret,
+        client_id=credentials.client_id,
+        client_secret=credentials.client_secret,
         refresh_token=refresh_token,
         retry_budget_seconds=300,
     )
@@ -152,19 +297,23 @@ async def publish_impl(
     prev_playlists = Playlists.from_json(content)
 
     # Read scraped playlists from local storage
-    scraped_playlists = get_scraped_playlists(playlists_dir)
+    get_scraped_playlists_coro = get_scraped_playlists(
+        playlists_dir,
+        cache_path=repo_dir / ".playlist_cache.pkl",
+    )
 
     # Fetch published playlists from Spotify
     if prod:
-        published_playlists = {
-            playlist.playlist_id: playlist
-            async for playlist in spotify.get_published_playlists()
-        }
+        # Read from disk while waiting on the network
+        scraped_playlists, published_playlists = await asyncio.gather(
+            get_scraped_playlists_coro,
+            get_all_published_playlists(spotify),
+        )
     else:
         scraped_playlists, published_playlists = await get_test_playlists(
             spotify=spotify,
             prev_playlists=prev_playlists,
-            scraped_playlists=scraped_playlists,
+            scraped_playlists=await get_scraped_playlists_coro,
         )
 
     # Auxiliary data structure for quick lookups
@@ -200,75 +349,66 @@ async def publish_impl(
 
     # Delete all published playlists without a valid reference
     published_playlists_to_delete = (
-        set(published_playlists) - published_playlists_to_retain
+        published_playlists.keys() - published_playlists_to_retain
     )
 
     # Create missing playlists
-    for scraped_playlist_id in sorted(unpublished_scraped_playlists):
-        name = scraped_playlists[scraped_playlist_id].name
+    scraped_playlist_ids_to_create = sorted(unpublished_scraped_playlists)
+    names_to_create = [
+        scraped_playlists[scraped_playlist_id].name
+        for scraped_playlist_id in scraped_playlist_ids_to_create
+    ]
+    for name in names_to_create:
         logger.info(f"Creating playlist: {name}")
-        if prod:
-            published_playlist_id = await spotify.create_playlist(name)
-        else:
-            # When testing, just use a fake playlist ID
-            published_playlist_id = PublishedPlaylistID(f"playlist_id:{name}")
+    if prod:
+        created_playlist_ids = await gather_with_limit(
+            [spotify.create_playlist(name) for name in names_to_create]
+        )
+    else:
+        # When testing, just use fake playlist IDs
+        created_playlist_ids = [
+            PublishedPlaylistID(f"playlist_id:{name}") for name in names_to_create
+        ]
+    for scraped_playlist_id, name, published_playlist_id in zip(
+        scraped_playlist_ids_to_create, names_to_create, created_playlist_ids
+    ):
         published_playlists[published_playlist_id] = PublishedPlaylist(
             playlist_id=published_playlist_id,
             name=name,
             description="",
-            track_ids=set(),
+            track_ids=frozenset(),
         )
         next_playlists_dict[scraped_playlist_id].append(published_playlist_id)
 
     # Update existing playlists
+    update_coros: List[Coroutine[Any, Any, None]] = []
     for scraped_playlist_id, scraped_playlist in sorted(scraped_playlists.items()):
-        scraped_name = scraped_playlist.name
-        scraped_track_ids = scraped_playlist.track_ids
-        scraped_description = scraped_playlist.description
-
         # TODO: Support large playlists - don't just grab the first published
         # playlist; instead calclate how many published playlists are required,
         # create them, and then update them
         published_playlist_ids = next_playlists_dict[scraped_playlist_id]
         assert len(published_playlist_ids) == 1
-        published_playlist_id = published_playlist_ids[0]
-        published_playlist = published_playlists[published_playlist_id]
-        published_name = published_playlist.name
-        published_track_ids = published_playlist.track_ids
-        published_description = published_playlist.description
-
-        details_to_change = {}
-        if published_name != scraped_name:
-            details_to_change["name"] = scraped_name
-        if published_description != scraped_description:
-            details_to_change["description"] = scraped_description
-        if details_to_change:
-            logger.info(f"Updating playlist details: {details_to_change}")
-            if prod:
-                await spotify.change_playlist_details(
-                    published_playlist_id, details_to_change
-                )
-
-        tracks_to_add = list(scraped_track_ids - published_track_ids)
-        if tracks_to_add:
-            count = len(tracks_to_add)
-            logger.info(f"Adding {count} track(s) to playlist: {scraped_name}")
-            if prod:
-                await spotify.add_items(published_playlist_id, tracks_to_add)
-
-        tracks_to_remove = list(published_track_ids - scraped_track_ids)
-        if tracks_to_remove:
-            count = len(tracks_to_remove)
-            logger.info(f"Removing {count} track(s) from playlist: {scraped_name}")
-            if prod:
-                await spotify.remove_items(published_playlist_id, tracks_to_remove)
+        published_playlist = published_playlists[published_playlist_ids[0]]
+        update_coros.append(
+            update_published_playlist(
+                spotify=spotify,
+                scraped_playlist=scraped_playlist,
+                published_playlist=published_playlist,
+                prod=prod,
+            )
+        )
+    await gather_with_limit(update_coros)
 
     # Remove extra playlists
+    delete_coros: List[Coroutine[Any, Any, None]] = []
     for published_playlist_id in sorted(published_playlists_to_delete):
         name = published_playlists[published_playlist_id].name
         logger.info(f"Unsubscribing from playlist {published_playlist_id}: {name}")
         if prod:
-            await spotify.unsubscribe_from_playlist(published_playlist_id)
+            delete_coros.append(
+                spotify.unsubscribe_from_playlist(published_playlist_id)
+            )
+    await gather_with_limit(delete_coros)
 
     # Dump JSON
     playlists = Playlists(
@@ -280,8 +420,9 @@ async def publish_impl(
             for scraped_id, published_ids in sorted(next_playlists_dict.items())
         ]
     )
-    with open(json_path, "w") as f:
-        f.write(playlists.to_json() + "\n")
+    with open(json_path, "wb") as f:
+        f.write(playlists.to_json_bytes())
+        f.write(b"\n")
 
     # Update README.md, sort by name without suffix
     suffix = " (Cumulative)"
@@ -307,6 +448,60 @@ async def publish_impl(
         f.write("\n".join(new_lines) + "\n")
 
 
+async def update_published_playlist(
+    spotify: Spotify,
+    scraped_playlist: ScrapedPlaylist,
+    published_playlist: PublishedPlaylist,
+    prod: bool,
+) -> None:
+    # Changes to a single playlist are applied in order, only separate
+    # playlists are updated concurrently
+    published_playlist_id = published_playlist.playlist_id
+    scraped_name = scraped_playlist.name
+    scraped_track_ids = scraped_playlist.track_ids
+    published_track_ids = published_playlist.track_ids
+
+    details_to_change = {}
+    if published_playlist.name != scraped_name:
+        details_to_change["name"] = scraped_name
+    if published_playlist.description != scraped_playlist.description:
+        details_to_change["description"] = scraped_playlist.description
+    if details_to_change:
+        logger.info(f"Updating playlist details: {details_to_change}")
+        if prod:
+            await spotify.change_playlist_details(
+                published_playlist_id, details_to_change
+            )
+
+    # Equality bails out early on a size mismatch, so check it before
+    # computing both differences
+    if scraped_track_ids == published_track_ids:
+        return
+
+    tracks_to_add = list(scraped_track_ids - published_track_ids)
+    if tracks_to_add:
+        count = len(tracks_to_add)
+        logger.info(f"Adding {count} track(s) to playlist: {scraped_name}")
+        if prod:
+            await spotify.add_items(published_playlist_id, tracks_to_add)
+
+    tracks_to_remove = list(published_track_ids - scraped_track_ids)
+    if tracks_to_remove:
+        count = len(tracks_to_remove)
+        logger.info(f"Removing {count} track(s) from playlist: {scraped_name}")
+        if prod:
+            await spotify.remove_items(published_playlist_id, tracks_to_remove)
+
+
+async def get_all_published_playlists(
+    spotify: Spotify,
+) -> Dict[PublishedPlaylistID, PublishedPlaylist]:
+    return {
+        playlist.playlist_id: playlist
+        async for playlist in spotify.get_published_playlists()
+    }
+
+
 async def get_test_playlists(
     spotify: Spotify,
     prev_playlists: Playlists,
@@ -344,19 +539,46 @@ async def get_test_playlists(
     raise Exception("No suitable test playlists found")
 
 
+async def gather_with_limit(
+    coros: Sequence[Coroutine[Any, Any, T]], limit: int = 3
+) -> List[T]:
+    # Run independent requests concurrently, but keep the number in flight
+    # as small as when fetching playlists. Every request in flight draws on
+    # the client's shared retry budget when rate limited.
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro: Coroutine[Any, Any, T]) -> T:
+        async with semaphore:
+            return await coro
+
+    tasks = [asyncio.ensure_future(run(coro)) for coro in coros]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # Stop at the first failure, like sequential code would, and wait
+        # for the remaining requests to wind down before the caller gets a
+        # chance to close the session underneath them
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Requests that were cancelled before they started were never
+        # awaited, close them to avoid warnings
+        for coro in coros:
+            coro.close()
+        raise
+
+
 async def login() -> None:
     # Login OAuth flow.
     #
-    # 1. Opens the authorize url in the default browser (on Linux).
+    # 1. Opens the authorize url in the default browser.
     # 2. Sets up an HTTP server on port 8000 to listen for the callback.
     # 3. Requests a refresh token for the user and prints it.
 
     # Build the target URL
-    client_id = Environment.get_env("SPOTIFY_CLIENT_ID")
-    client_secret = Environment.get_env("SPOTIFY_CLIENT_SECRET")
-    assert client_id and client_secret
+    credentials = get_client_credentials()
     query_params = {
-        "client_id": client_id,
+        "client_id": credentials.client_id,
         "response_type": "code",
         "redirect_uri": Spotify.REDIRECT_URI,
         "scope": "playlist-modify-public",
@@ -368,7 +590,7 @@ async def login() -> None:
     # Print and try to open the URL in the default browser.
     print("Opening the following URL in a browser (at least trying to):")
     print(target_url)
-    os.system("xdg-open '{}'".format(target_url))
+    webbrowser.open(target_url)
 
     # Set up a temporary HTTP server and listen for the callback
     import socketserver
@@ -388,15 +610,19 @@ async def login() -> None:
             self.end_headers()
             self.wfile.write(b"OK!")
 
+    class Server(socketserver.TCPServer):
+        # Allow logging in again without waiting for TIME_WAIT to expire
+        allow_reuse_address = True
+
     PORT = 8000
-    httpd = socketserver.TCPServer(("", PORT), RequestHandler)
+    httpd = Server(("", PORT), RequestHandler)
     httpd.handle_request()
     httpd.server_close()
 
     # Request a refresh token for given the authorization code
     refresh_token = await Spotify.get_user_refresh_token(
-        client_id=client_id,
-        client_secret=client_secret,
+        client_id=credentials.client_id,
+        client_secret=credentials.client_secret,
         authorization_code=authorization_code,
     )
 
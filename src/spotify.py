@@ -5,7 +5,16 @@ import contextlib
 import dataclasses
 import enum
 import logging
-from typing import Any, AsyncIterator, Dict, Mapping, Optional, Sequence, Set
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    FrozenSet,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+)
 
 import aiohttp
 
@@ -276,8 +285,8 @@ class Spotify:
             track_ids=track_ids,
         )
 
-    async def _get_track_ids(self, playlist_id: PublishedPlaylistID) -> Set[str]:
-        track_ids = set()
+    async def _get_track_ids(self, playlist_id: PublishedPlaylistID) -> FrozenSet[str]:
+        track_ids: Set[str] = set()
         url = (
             self.BASE_URL
             + f"/playlists/{playlist_id}/tracks?fields=next,items.track(id)"
@@ -290,7 +299,7 @@ class Spotify:
                     continue
                 track_ids.add(track["id"])
             url = data["next"]
-        return track_ids
+        return frozenset(track_ids)
 
     async def create_playlist(self, name: str) -> PublishedPlaylistID:
         url = self.BASE_URL + f"/users/{self.USER_ID}/playlists"
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
+import asyncio
 import os
 import pathlib
 import tempfile
 import textwrap
-from typing import AsyncIterator, Dict, TypeVar
+from typing import AsyncIterator, Dict, List, TypeVar
 from unittest import IsolatedAsyncioTestCase, TestCase
 from unittest.mock import AsyncMock, Mock, call, patch, sentinel
 
@@ -18,8 +19,11 @@ from playlist_types import (
 from script import (
     PlaylistMapping,
     Playlists,
+    _read_scraped_playlist,
+    gather_with_limit,
     get_scraped_playlists,
     publish_impl,
+    update_published_playlist,
 )
 
 T = TypeVar("T")
@@ -104,10 +108,10 @@ class TestPlaylistsToAndFromJSON(TestCase):
         self.assertEqual(playlists, Playlists.from_json(playlists_json))
 
 
-class TestGetScrapedPlaylists(TestCase):
+class TestGetScrapedPlaylists(IsolatedAsyncioTestCase):
     # Patch the logger to suppress log spew
     @patch("script.logger")
-    def test_success(self, mock_logger: Mock) -> None:
+    async def test_success(self, mock_logger: Mock) -> None:
         with tempfile.TemporaryDirectory() as temp_dir:
             playlists_dir = pathlib.Path(temp_dir)
             cumulative_dir = playlists_dir / "cumulative"
@@ -145,7 +149,7 @@ class TestGetScrapedPlaylists(TestCase):
                     )
                 )
 
-            scraped_playlists = get_scraped_playlists(playlists_dir)
+            scraped_playlists = await get_scraped_playlists(playlists_dir)
             self.assertEqual(
                 scraped_playlists,
                 {
@@ -155,7 +159,7 @@ class TestGetScrapedPlaylists(TestCase):
                         description=(
                             "Link to archive: https://tinyurl.com/4mvw765u/foo.md"
                         ),
-                        track_ids={"1", "2", "3"},
+                        track_ids=frozenset({"1", "2", "3"}),
                     ),
                     ScrapedPlaylistID("bar"): ScrapedPlaylist(
                         playlist_id=ScrapedPlaylistID("bar"),
@@ -163,11 +167,136 @@ class TestGetScrapedPlaylists(TestCase):
                         description=(
                             "Link to archive: https://tinyurl.com/4mvw765u/bar.md"
                         ),
-                        track_ids={"3", "4", "5"},
+                        track_ids=frozenset({"3", "4", "5"}),
                     ),
                 },
             )
 
+    # Patch the logger to suppress log spew
+    @patch("script.logger")
+    async def test_cache(self, mock_logger: Mock) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            playlists_dir = pathlib.Path(temp_dir)
+            cumulative_dir: pathlib.Path = playlists_dir / "cumulative"
+            os.mkdir(cumulative_dir)
+            cache_path = playlists_dir / "cache.pkl"
+
+            def write_playlist(track_urls: List[str]) -> None:
+                tracks = ", ".join(f'{{"url": "{url}"}}' for url in track_urls)
+                with open(cumulative_dir / "foo.json", "w") as f:
+                    f.write(f'{{"name": "Foo", "tracks": [{tracks}]}}')
+
+            # Cold cache, the file is parsed
+            write_playlist(["https://open.spotify.com/track/1"])
+            scraped_playlists = await get_scraped_playlists(playlists_dir, cache_path)
+            self.assertEqual(
+                scraped_playlists[ScrapedPlaylistID("foo")].track_ids, {"1"}
+            )
+
+            # Warm cache, the file is not parsed and the cache is not rewritten
+            with patch("script._read_scraped_playlist") as mock_read, patch(
+                "script._write_scraped_playlists_cache"
+            ) as mock_write:
+                cached_playlists = await get_scraped_playlists(
+                    playlists_dir, cache_path
+                )
+            mock_read.assert_not_called()
+            mock_write.assert_not_called()
+            self.assertEqual(cached_playlists, scraped_playlists)
+
+            # Outdated cache format, the file is parsed again
+            with patch("script._SCRAPED_PLAYLISTS_CACHE_VERSION", -1), patch(
+                "script._read_scraped_playlist",
+                wraps=_read_scraped_playlist,
+            ) as mock_read:
+                await get_scraped_playlists(playlists_dir, cache_path)
+            mock_read.assert_called_once()
+
+            # Stale cache, the file is parsed again
+            write_playlist(
+                [
+                    "https://open.spotify.com/track/1",
+                    "https://open.spotify.com/track/2",
+                ]
+            )
+            scraped_playlists = await get_scraped_playlists(playlists_dir, cache_path)
+            self.assertEqual(
+                scraped_playlists[ScrapedPlaylistID("foo")].track_ids, {"1", "2"}
+            )
+
+
+class TestGatherWithLimit(IsolatedAsyncioTestCase):
+    async def test_success(self) -> None:
+        in_flight = 0
+        max_in_flight = 0
+
+        async def double(x: int) -> int:
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            return 2 * x
+
+        results = await gather_with_limit([double(x) for x in range(10)], limit=3)
+        self.assertEqual(results, [2 * x for x in range(10)])
+        self.assertEqual(max_in_flight, 3)
+
+    async def test_failure(self) -> None:
+        started = 0
+        cancelled = 0
+
+        async def fail() -> None:
+            raise Exception("failed")
+
+        async def wait() -> None:
+            nonlocal started, cancelled
+            started += 1
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled += 1
+                raise
+
+        # The first failure stops all other requests before it propagates
+        with self.assertRaises(Exception):
+            await gather_with_limit([wait(), fail()] + [wait() for _ in range(3)])
+        self.assertGreater(started, 0)
+        self.assertEqual(started, cancelled)
+        self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+
+class TestUpdatePublishedPlaylist(IsolatedAsyncioTestCase):
+    # Patch the logger to suppress log spew
+    @patch("script.logger")
+    async def test_same_tracks(self, mock_logger: Mock) -> None:
+        mock_spotify = Mock()
+        mock_spotify.change_playlist_details = AsyncMock()
+        mock_spotify.add_items = AsyncMock()
+        mock_spotify.remove_items = AsyncMock()
+        await update_published_playlist(
+            spotify=mock_spotify,
+            scraped_playlist=ScrapedPlaylist(
+                playlist_id=ScrapedPlaylistID("scraped_id"),
+                name="new_name",
+                description="desc",
+                track_ids=frozenset({"1", "2"}),
+            ),
+            published_playlist=PublishedPlaylist(
+                playlist_id=PublishedPlaylistID("published_id"),
+                name="old_name",
+                description="desc",
+                track_ids=frozenset({"1", "2"}),
+            ),
+            prod=True,
+        )
+        # Details are still updated even though the tracks match
+        mock_spotify.change_playlist_details.assert_awaited_once_with(
+            "published_id", {"name": "new_name"}
+        )
+        mock_spotify.add_items.assert_not_called()
+        mock_spotify.remove_items.assert_not_called()
+
 
 class TestPublishImpl(IsolatedAsyncioTestCase):
     async def asyncSetUp(self) -> None:
@@ -183,7 +312,9 @@ class TestPublishImpl(IsolatedAsyncioTestCase):
         self.mock_get_scraped_playlists = UnittestUtils.patch(
             self,
             "script.get_scraped_playlists",
-            new_callable=lambda: Mock(side_effect=self._mock_get_scraped_playlists),
+            new_callable=lambda: AsyncMock(
+                side_effect=self._mock_get_scraped_playlists
+            ),
         )
 
         self.mock_playlists_dir = sentinel.playlists_dir
@@ -206,7 +337,7 @@ class TestPublishImpl(IsolatedAsyncioTestCase):
         self.temp_dir.cleanup()
 
     def _mock_get_scraped_playlists(
-        self, playlists_dir: pathlib.Path
+        self, playlists_dir: pathlib.Path, cache_path: pathlib.Path
     ) -> Dict[ScrapedPlaylistID, ScrapedPlaylist]:
         return {
             # Has a valid mapping
@@ -214,21 +345,21 @@ class TestPublishImpl(IsolatedAsyncioTestCase):
                 playlist_id=ScrapedPlaylistID("scraped_1_id"),
                 name="scraped_1_name (Cumulative)",
                 description="Scraped_1_desc",
-                track_ids={"1", "2"},
+                track_ids=frozenset({"1", "2"}),
             ),
             # Has an invalid mapping
             ScrapedPlaylistID("scraped_2_id"): ScrapedPlaylist(
                 playlist_id=ScrapedPlaylistID("scraped_2_id"),
                 name="scraped_2_name (Cumulative)",
                 description="scraped_2_desc",
-                track_ids={"123"},
+                track_ids=frozenset({"123"}),
             ),
             # Has no mapping
             ScrapedPlaylistID("scraped_3_id"): ScrapedPlaylist(
                 playlist_id=ScrapedPlaylistID("scraped_3_id"),
                 name="scraped_3_name (Cumulative)",
                 description="scraped_3_desc",
-                track_ids={"123"},
+                track_ids=frozenset({"123"}),
             ),
         }
 
@@ -238,21 +369,21 @@ class TestPublishImpl(IsolatedAsyncioTestCase):
             playlist_id=PublishedPlaylistID("published_1_id"),
             name="\t published_1_name (Cumulative) ",  # ensure whitespace is stripped
             description="published_1_desc",
-            track_ids={"2", "3"},
+            track_ids=frozenset({"2", "3"}),
         )
         # Has an invalid mapping
         yield PublishedPlaylist(
             playlist_id=PublishedPlaylistID("published_2_id"),
             name="published_2_name (Cumulative)",
             description="published_2_desc",
-            track_ids={"456"},
+            track_ids=frozenset({"456"}),
         )
         # Has no mapping (unreferenced)
         yield PublishedPlaylist(
             playlist_id=PublishedPlaylistID("published_3_id"),
             name="published_3_name (Cumulative)",
             description="published_3_desc",
-            track_ids={"456"},
+            track_ids=frozenset({"456"}),
         )
 
     # Patch the logger to suppress log spew
@@ -302,7 +433,10 @@ class TestPublishImpl(IsolatedAsyncioTestCase):
             playlists_dir=self.mock_playlists_dir,
             prod=True,
         )
-        self.mock_get_scraped_playlists.assert_called_once_with(self.mock_playlists_dir)
+        self.mock_get_scraped_playlists.assert_awaited_once_with(
+            self.mock_playlists_dir,
+            cache_path=self.repo_dir / ".playlist_cache.pkl",
+        )
         self.mock_spotify.get_published_playlists.assert_called_once_with()
         with open(self.repo_dir / "README.md", "r") as f:
             prefix = "https://open.spotify.com/playlist"
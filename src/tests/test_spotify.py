@@ -155,7 +155,7 @@ class TestGetPlaylist(SpotifyTestCase):
             "spotify.Spotify._get_track_ids",
             new_callable=AsyncMock,
         )
-        self.mock_get_track_ids.return_value = {"track"}
+        self.mock_get_track_ids.return_value = frozenset({"track"})
 
     # Patch the logger to suppress log spew
     @patch("spotify.logger")
@@ -204,7 +204,7 @@ class TestGetPlaylist(SpotifyTestCase):
                 playlist_id=playlist_id,
                 name="playlist_name",
                 description="playlist_description",
-                track_ids={"track"},
+                track_ids=frozenset({"track"}),
             ),
         )
         self.assertEqual(self.mock_session.get.call_count, 2)
@@ -238,7 +238,7 @@ class TestGetPlaylist(SpotifyTestCase):
                 playlist_id=playlist_id,
                 name="playlist_name",
                 description="https://foo",
-                track_ids={"track"},
+                track_ids=frozenset({"track"}),
             ),
         )
         self.assertEqual(self.mock_session.get.call_count, 2)